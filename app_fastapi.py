@@ -1,14 +1,21 @@
 import os
+import re
+import asyncio
+import hashlib
 import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, UploadFile, File, Request, Depends
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
+from starlette.datastructures import Headers
 from pydantic import BaseModel
+from cachetools import TTLCache
 import uuid
-from chat_service import ChatService
+import weakref
+from chat_service import ChatService, get_llm, get_embedding
 from dotenv import load_dotenv
 import aiofiles
 from pathlib import Path
@@ -20,8 +27,101 @@ load_dotenv()
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# Configuration
+UPLOAD_FOLDER = 'uploads'
+ALLOWED_EXTENSIONS = ('.pdf',)
+MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB max file size
+MAX_REQUEST_SIZE = MAX_FILE_SIZE + 1024 * 1024  # Allow for multipart framing overhead
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # Bytes read from the upload per iteration
+SESSION_CACHE_SIZE = 256  # Maximum concurrent chat sessions kept in memory
+SESSION_TTL = 3600  # Seconds before an idle chat session is dropped
+LLM_CONCURRENCY = 8  # Maximum blocking LangChain calls running in worker threads
+
+# Filename sanitization patterns
+UNSAFE_FILENAME_CHARS = re.compile(r'[^\w\s\-_\.]')
+FILENAME_WHITESPACE = re.compile(r'[\s]+')
+
+# Messages answered directly without querying the document
+GREETINGS = frozenset({"hi", "hello", "hey", "good morning", "good afternoon", "good evening"})
+GREETING_RESPONSE = "Hello! I'm your PDF assistant. I can help you with questions about the uploaded document. How can I assist you today?"
+
+class MaxBodySizeMiddleware:
+    """ASGI middleware that rejects request bodies larger than a fixed limit.
+    
+    Requests declaring an oversized Content-Length are refused before any of
+    the body is read; bodies without one are counted as they stream in.
+    """
+
+    def __init__(self, app, max_body_size: int):
+        self.app = app
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_body_size:
+            response = ORJSONResponse(
+                {"detail": "File too large. Maximum size is 16MB."},
+                status_code=413
+            )
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    raise HTTPException(status_code=413, detail="File too large. Maximum size is 16MB.")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+class ChatSessionCache(TTLCache):
+    """TTL/LRU cache of per-session ChatService instances that closes evicted services."""
+
+    def popitem(self):
+        key, service = super().popitem()
+        logger.info(f"Evicting chat session: {key}")
+        self._close(key, service)
+        return key, service
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        for key, service in expired:
+            logger.info(f"Expiring chat session: {key}")
+            self._close(key, service)
+        return expired
+
+    @staticmethod
+    def _close(key, service):
+        # A held lock means a request is using the service in a worker thread;
+        # leave it intact and let it be garbage collected once that finishes
+        lock = session_locks.get(key)
+        if lock is None or not lock.locked():
+            service.close()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create the shared Google AI clients once at startup."""
+    try:
+        get_llm()
+        get_embedding()
+        logger.info("Google Generative AI clients initialized")
+    except Exception as e:
+        # ChatService will retry and report the error on upload
+        logger.error(f"Error initializing Google Generative AI clients: {str(e)}")
+    yield
+
 # Create FastAPI app
-app = FastAPI(title="PDF ChatBot API", description="AI Document Assistant", version="1.0.0")
+app = FastAPI(title="PDF ChatBot API", description="AI Document Assistant", version="1.0.0",
+              default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # Add session middleware
 app.add_middleware(
@@ -38,10 +138,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Configuration
-UPLOAD_FOLDER = 'uploads'
-ALLOWED_EXTENSIONS = {'pdf'}
-MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB max file size
+# Reject oversized bodies while they are being received
+app.add_middleware(MaxBodySizeMiddleware, max_body_size=MAX_REQUEST_SIZE)
 
 # Ensure upload directory exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -52,8 +150,14 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 # Templates
 templates = Jinja2Templates(directory="templates")
 
-# Global chat service instance
-chat_service = None
+# Chat service instances and their locks, keyed by session id
+chat_sessions = ChatSessionCache(maxsize=SESSION_CACHE_SIZE, ttl=SESSION_TTL)
+# Locks are only weakly held: one lives exactly as long as a request holds or
+# waits on it, so a lock in use is never dropped or replaced
+session_locks = weakref.WeakValueDictionary()
+
+# Bounds the blocking LangChain work offloaded from the event loop
+llm_semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
 
 # Pydantic models
 class ChatMessage(BaseModel):
@@ -78,18 +182,55 @@ class ErrorResponse(BaseModel):
 
 def allowed_file(filename: str) -> bool:
     """Check if the uploaded file has an allowed extension."""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    return filename.lower().endswith(ALLOWED_EXTENSIONS)
 
 def secure_filename(filename: str) -> str:
     """Secure a filename by removing unsafe characters."""
-    import re
     # Remove or replace unsafe characters
-    filename = re.sub(r'[^\w\s\-_\.]', '', filename)
+    filename = UNSAFE_FILENAME_CHARS.sub('', filename)
     # Replace spaces with underscores
-    filename = re.sub(r'[\s]+', '_', filename)
+    filename = FILENAME_WHITESPACE.sub('_', filename)
     return filename
 
+def get_session_id(request: Request) -> str:
+    """Return the id of the current session, assigning one on first use."""
+    sid = request.session.get('sid')
+    if not sid:
+        sid = str(uuid.uuid4())
+        request.session['sid'] = sid
+    return sid
+
+def get_session_lock(sid: str) -> asyncio.Lock:
+    """Return the lock serializing work on a session's chat service."""
+    lock = session_locks.get(sid)
+    if lock is None:
+        lock = session_locks[sid] = asyncio.Lock()
+    return lock
+
+async def save_upload(file: UploadFile, file_path: str) -> str:
+    """Stream an upload to disk and return its SHA-256 hex digest.
+    
+    The size limit and hash are applied in the same pass as the write. The
+    file is written under a temporary name and only moved into place once
+    it is complete.
+    """
+    tmp_path = f"{file_path}.part"
+    size = 0
+    digest = hashlib.sha256()
+    try:
+        async with aiofiles.open(tmp_path, 'wb') as f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > MAX_FILE_SIZE:
+                    raise HTTPException(status_code=413, detail="File too large. Maximum size is 16MB.")
+                digest.update(chunk)
+                await f.write(chunk)
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return digest.hexdigest()
+
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
     """Main page route."""
@@ -98,7 +239,7 @@ async def index(request: Request):
 @app.post("/upload", response_model=UploadResponse)
 async def upload_file(request: Request, file: UploadFile = File(...)):
     """Handle PDF file upload."""
-    global chat_service
+    sid = get_session_id(request)
     
     try:
         # Check if file is provided
@@ -109,19 +250,13 @@ async def upload_file(request: Request, file: UploadFile = File(...)):
         if not allowed_file(file.filename):
             raise HTTPException(status_code=400, detail="Only PDF files are allowed")
         
-        # Check file size
-        contents = await file.read()
-        if len(contents) > MAX_FILE_SIZE:
-            raise HTTPException(status_code=413, detail="File too large. Maximum size is 16MB.")
-        
         # Generate unique filename
         filename = secure_filename(file.filename)
         unique_filename = f"{uuid.uuid4()}_{filename}"
         file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
         
-        # Save file
-        async with aiofiles.open(file_path, 'wb') as f:
-            await f.write(contents)
+        # Save file, validating and hashing it in the same pass
+        digest = await save_upload(file, file_path)
         
         # Store file info in session
         request.session['uploaded_file'] = {
@@ -132,7 +267,29 @@ async def upload_file(request: Request, file: UploadFile = File(...)):
         
         # Initialize chat service with the uploaded PDF
         try:
-            chat_service = ChatService(file_path)
+            async with get_session_lock(sid):
+                existing = chat_sessions.get(sid)
+                if existing is not None and existing.digest == digest \
+                        and os.path.exists(existing.pdf_path):
+                    # Same content as the current document: keep its index and conversation
+                    chat_sessions[sid] = existing
+                    os.remove(file_path)
+                    request.session['uploaded_file'].update(
+                        path=existing.pdf_path,
+                        unique_filename=os.path.basename(existing.pdf_path)
+                    )
+                else:
+                    # Clients are built on the event loop thread (the embeddings
+                    # client creates an asyncio channel); the PDF work runs in a thread
+                    get_llm()
+                    get_embedding()
+                    async with llm_semaphore:
+                        service = await asyncio.to_thread(
+                            ChatService, file_path, digest=digest
+                        )
+                    chat_sessions[sid] = service
+                    if existing is not None:
+                        existing.close()
             logger.info(f"Successfully initialized chat service with file: {filename}")
             return UploadResponse(
                 success=True,
@@ -155,25 +312,31 @@ async def upload_file(request: Request, file: UploadFile = File(...)):
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: Request, chat_message: ChatMessage):
     """Handle chat messages."""
-    global chat_service
+    sid = get_session_id(request)
     
     try:
         message = chat_message.message.strip()
         if not message:
             raise HTTPException(status_code=400, detail="Empty message")
         
-        # Check if chat service is initialized
-        if chat_service is None:
-            raise HTTPException(status_code=400, detail="Please upload a PDF file first")
-        
-        # Handle greeting messages
-        if message.lower() in ["hi", "hello", "hey", "good morning", "good afternoon", "good evening"]:
-            response = "Hello! I'm your PDF assistant. I can help you with questions about the uploaded document. How can I assist you today?"
-        else:
-            # Get response from chat service
-            response = chat_service.get_response(message)
+        async with get_session_lock(sid):
+            # Check if chat service is initialized
+            chat_service = chat_sessions.get(sid)
+            if chat_service is None:
+                raise HTTPException(status_code=400, detail="Please upload a PDF file first")
+            # Re-insert to restart the TTL, so sessions expire after idle time
+            chat_sessions[sid] = chat_service
+            
+            # Handle greeting messages
+            if message.lower() in GREETINGS:
+                response = GREETING_RESPONSE
+            else:
+                # Get response from chat service without blocking the event loop
+                async with llm_semaphore:
+                    response = await asyncio.to_thread(chat_service.get_response, message)
         
-        return ChatResponse(response=response, message=message)
+        # Serialize directly; the payload already matches ChatResponse
+        return ORJSONResponse({"response": response, "message": message})
         
     except HTTPException:
         raise
@@ -184,7 +347,7 @@ async def chat(request: Request, chat_message: ChatMessage):
 @app.post("/clear")
 async def clear_chat(request: Request):
     """Clear the current chat session and uploaded file."""
-    global chat_service
+    sid = get_session_id(request)
     
     try:
         # Clean up uploaded file
@@ -197,7 +360,10 @@ async def clear_chat(request: Request):
         
         # Clear session and chat service
         request.session.clear()
-        chat_service = None
+        async with get_session_lock(sid):
+            chat_service = chat_sessions.pop(sid, None)
+            if chat_service is not None:
+                chat_service.close()
         
         return {"success": True, "message": "Chat cleared successfully"}
         
@@ -209,7 +375,8 @@ async def clear_chat(request: Request):
 async def status(request: Request):
     """Get current chat status."""
     try:
-        has_file = 'uploaded_file' in request.session and chat_service is not None
+        sid = request.session.get('sid')
+        has_file = 'uploaded_file' in request.session and sid in chat_sessions
         filename = request.session.get('uploaded_file', {}).get('filename', '') if has_file else ''
         
         return StatusResponse(
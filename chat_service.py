@@ -1,10 +1,22 @@
 import os
+import hashlib
 import logging
+import pickle
+import shutil
+import tempfile
+import threading
+import numpy as np
+import faiss
 from langchain_community.document_loaders import PyPDFLoader
-from langchain.indexes import VectorstoreIndexCreator
-from langchain.text_splitter import CharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAI, GoogleGenerativeAIEmbeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain.indexes.vectorstore import VectorStoreIndexWrapper
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.chains import RetrievalQA
+from langchain_core.prompts import PromptTemplate
+from langchain_google_genai import GoogleGenerativeAI
 from langchain.memory import ConversationBufferWindowMemory
+from embedding_cache import CACHE_DIR, CachedEmbeddings
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -13,99 +25,361 @@ load_dotenv()
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Directories for per-document caches, keyed by PDF content hash
+DOCUMENT_CACHE_DIR = os.path.join(CACHE_DIR, "documents")
+INDEX_CACHE_DIR = os.path.join(CACHE_DIR, "indexes")
+
+# Semantic response cache configuration
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "512"))
+
+# Text splitter parameters
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 120
+CHUNK_SEPARATORS = ["\n\n", "\n", ". ", " ", ""]
+
+# System instruction for the document assistant, applied in the LLM prompt only
+SYSTEM_PROMPT = """You are a professional assistant for analyzing PDF documents. Please:
+1. Answer questions based on the content of the uploaded PDF document
+2. Be helpful, accurate, and concise in your responses
+3. If a question cannot be answered from the PDF content, politely state that the information is not available in the document
+4. Maintain a professional and friendly tone
+5. Focus on providing relevant information from the document"""
+
+QA_PROMPT = PromptTemplate(
+    template="{system}\n\nContext:\n{context}\n\nQuestion: {question}\n\nAnswer:",
+    input_variables=["context", "question"],
+    partial_variables={"system": SYSTEM_PROMPT}
+)
+
+# Number of chunks retrieved per question
+RETRIEVER_K = 4
+
+# HNSW index parameters
+HNSW_M = 32
+HNSW_EF_SEARCH = 64
+INDEX_FORMAT = "hnswsq8"  # Part of the saved-index key; change when the index type changes
+
+# Scale mapping unit-vector components onto int8
+INT8_SCALE = 127
+
+def _get_api_key():
+    """Return the Google API key, raising if it is not configured."""
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError("GOOGLE_API_KEY is not set in environment variables")
+    return api_key
+
+def file_digest(path):
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def create_llm():
+    """Create the Google Generative AI LLM client."""
+    return GoogleGenerativeAI(
+        model="gemini-1.5-flash",
+        google_api_key=_get_api_key(),
+        temperature=0.7,
+        max_tokens=1024
+    )
+
+def create_embedding():
+    """Create the cached Google Generative AI embeddings client."""
+    return CachedEmbeddings(
+        model="models/embedding-001",
+        google_api_key=_get_api_key()
+    )
+
+# Process-wide Google AI clients, shared by every ChatService
+_llm = None
+_embedding = None
+_client_lock = threading.Lock()
+
+def get_llm():
+    """Return the shared LLM client, creating it on first use."""
+    global _llm
+    
+    if _llm is None:
+        with _client_lock:
+            if _llm is None:
+                logger.info("Initializing Google Generative AI LLM...")
+                _llm = create_llm()
+    return _llm
+
+def get_embedding():
+    """Return the shared embeddings client, creating it on first use."""
+    global _embedding
+    
+    if _embedding is None:
+        with _client_lock:
+            if _embedding is None:
+                logger.info("Initializing Google Generative AI embeddings...")
+                _embedding = create_embedding()
+    return _embedding
+
 class ChatService:
     """Service class for handling PDF chat functionality using LangChain and Google AI."""
     
-    def __init__(self, pdf_path):
-        """Initialize the chat service with a PDF file."""
+    def __init__(self, pdf_path, llm=None, embedding=None, digest=None,
+                 cache_threshold=SEMANTIC_CACHE_THRESHOLD, cache_size=SEMANTIC_CACHE_SIZE):
+        """Initialize the chat service with a PDF file.
+        
+        ``llm`` and ``embedding`` default to the process-wide clients so
+        connections and auth tokens are reused across services. ``digest`` is
+        the SHA-256 of the file contents, computed from the file if omitted.
+        """
         self.pdf_path = pdf_path
-        self.llm = None
+        self.digest = digest
+        self.llm = llm
         self.memory = None
+        self.embedding = embedding
         self.store = None
+        self._qa = None
+        self.cache_threshold = cache_threshold
+        self.cache_size = cache_size
+        self._qcache = []  # list of [int8 unit embedding, response, last used tick]
+        self._qcache_matrix = None
+        self._qcache_tick = 0
         self._initialize_components()
     
     def _initialize_components(self):
         """Initialize all LangChain components."""
         try:
-            # Get API key
-            api_key = os.getenv("GOOGLE_API_KEY")
-            if not api_key:
-                raise ValueError("GOOGLE_API_KEY is not set in environment variables")
-            
-            logger.info("Initializing Google Generative AI components...")
-            
-            # Initialize LLM
-            self.llm = GoogleGenerativeAI(
-                model="gemini-1.5-flash",
-                google_api_key=api_key,
-                temperature=0.7,
-                max_tokens=1024
-            )
+            # Use the shared clients unless specific ones were provided
+            if self.llm is None:
+                self.llm = get_llm()
+            if self.embedding is None:
+                self.embedding = get_embedding()
             
             # Initialize memory
             self.memory = ConversationBufferWindowMemory(k=5)
             
-            # Load PDF
-            logger.info(f"Loading PDF: {self.pdf_path}")
-            loader = PyPDFLoader(self.pdf_path)
-            
-            # Create embeddings
-            logger.info("Creating embeddings...")
-            embedding = GoogleGenerativeAIEmbeddings(
-                model="models/embedding-001"
-            )
-            
-            # Create text splitter
-            text_splitter = CharacterTextSplitter(
-                chunk_size=500, 
-                chunk_overlap=100
-            )
+            # Reuse the saved index for this content, or load, split and index the PDF
+            if self.digest is None:
+                self.digest = file_digest(self.pdf_path)
+            vectorstore = self._load_vectorstore()
+            if vectorstore is None:
+                documents = self._load_documents()
+                
+                # Create index
+                logger.info("Creating vector store index...")
+                vectorstore = self._build_vectorstore(documents)
+                self._save_vectorstore(vectorstore)
+            self.store = VectorStoreIndexWrapper(vectorstore=vectorstore)
             
-            # Create index
-            logger.info("Creating vector store index...")
-            index_creator = VectorstoreIndexCreator(
-                embedding=embedding,
-                text_splitter=text_splitter
+            # Build the question-answering chain once and reuse it for every query
+            self._qa = RetrievalQA.from_chain_type(
+                llm=self.llm,
+                retriever=vectorstore.as_retriever(search_kwargs={"k": RETRIEVER_K}),
+                memory=self.memory,
+                chain_type_kwargs={"prompt": QA_PROMPT}
             )
-            
-            self.store = index_creator.from_loaders([loader])
             logger.info("Chat service initialized successfully")
             
         except Exception as e:
             logger.error(f"Error initializing chat service: {str(e)}")
             raise e
     
+    def _cache_key(self):
+        """Return the name identifying this document's cached chunks."""
+        return f"{self.digest}_{CHUNK_SIZE}_{CHUNK_OVERLAP}"
+    
+    def _index_key(self):
+        """Return the name identifying this document's saved index.
+        
+        Includes the embedding model and index format, so indexes built with a
+        different model (and vector dimension) or index type are never reused.
+        """
+        model = self.embedding.model.replace("/", "-")
+        return f"{self._cache_key()}_{model}_{INDEX_FORMAT}"
+    
+    def _load_documents(self):
+        """Return the PDF split into chunks, using the on-disk cache when possible."""
+        cache_path = os.path.join(DOCUMENT_CACHE_DIR, f"{self._cache_key()}.pkl")
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'rb') as f:
+                    documents = pickle.load(f)
+                logger.info(f"Loaded {len(documents)} cached chunks for {self.pdf_path}")
+                return documents
+            except Exception as e:
+                logger.error(f"Error reading document cache {cache_path}: {str(e)}")
+        
+        logger.info(f"Loading PDF: {self.pdf_path}")
+        loader = PyPDFLoader(self.pdf_path)
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            separators=CHUNK_SEPARATORS
+        )
+        documents = loader.load_and_split(text_splitter)
+        
+        # Write to a private temp file, then rename it into place, so concurrent
+        # writers never share a file and readers only see complete pickles
+        tmp_path = None
+        try:
+            os.makedirs(DOCUMENT_CACHE_DIR, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=DOCUMENT_CACHE_DIR, suffix=".tmp")
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(documents, f)
+            os.replace(tmp_path, cache_path)
+        except Exception as e:
+            logger.error(f"Error writing document cache {cache_path}: {str(e)}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return documents
+    
+    def _build_vectorstore(self, documents):
+        """Embed the document chunks and index them in an 8-bit quantized FAISS HNSW graph."""
+        texts = [doc.page_content for doc in documents]
+        if not texts:
+            raise ValueError("No text could be extracted from the PDF")
+        vectors = self.embedding.embed_documents(texts)
+        
+        # The scalar quantizer learns per-dimension ranges from the normalized vectors
+        training = np.asarray(vectors, dtype=np.float32)
+        faiss.normalize_L2(training)
+        index = faiss.IndexHNSWSQ(training.shape[1], faiss.ScalarQuantizer.QT_8bit, HNSW_M)
+        index.train(training)
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        
+        vectorstore = FAISS(
+            embedding_function=self.embedding,
+            index=index,
+            docstore=InMemoryDocstore(),
+            index_to_docstore_id={},
+            normalize_L2=True
+        )
+        vectorstore.add_embeddings(
+            zip(texts, vectors),
+            metadatas=[doc.metadata for doc in documents]
+        )
+        return vectorstore
+    
+    def _load_vectorstore(self):
+        """Load this document's saved FAISS index, or return None if there is none."""
+        index_path = os.path.join(INDEX_CACHE_DIR, self._index_key())
+        if not os.path.isdir(index_path):
+            return None
+        try:
+            # Only indexes written by this service are ever loaded from this directory
+            vectorstore = FAISS.load_local(
+                index_path,
+                self.embedding,
+                allow_dangerous_deserialization=True,
+                normalize_L2=True
+            )
+            vectorstore.index.hnsw.efSearch = HNSW_EF_SEARCH
+            logger.info(f"Loaded saved vector store index for {self.pdf_path}")
+            return vectorstore
+        except Exception as e:
+            logger.error(f"Error loading saved index {index_path}: {str(e)}")
+            return None
+    
+    def _save_vectorstore(self, vectorstore):
+        """Save the FAISS index so the same content is never embedded twice."""
+        index_path = os.path.join(INDEX_CACHE_DIR, self._index_key())
+        tmp_path = None
+        try:
+            # Each writer saves into its own temp directory and renames it into
+            # place, so readers only ever see complete indexes
+            os.makedirs(INDEX_CACHE_DIR, exist_ok=True)
+            tmp_path = tempfile.mkdtemp(dir=INDEX_CACHE_DIR, suffix=".tmp")
+            vectorstore.save_local(tmp_path)
+            try:
+                os.replace(tmp_path, index_path)
+            except OSError:
+                # Another writer already saved this index; theirs is just as good
+                if not os.path.isdir(index_path):
+                    raise
+        except Exception as e:
+            logger.error(f"Error saving index {index_path}: {str(e)}")
+        finally:
+            if tmp_path and os.path.exists(tmp_path):
+                shutil.rmtree(tmp_path, ignore_errors=True)
+    
     def get_response(self, message):
         """Get a response from the AI based on the PDF content and user message."""
         try:
-            if not self.store or not self.llm:
+            if not self.store or not self._qa:
                 raise ValueError("Chat service not properly initialized")
             
-            # Create system instruction for hotel assistant behavior
-            hotel_context = """
-            You are a professional assistant for analyzing PDF documents. Please:
-            1. Answer questions based on the content of the uploaded PDF document
-            2. Be helpful, accurate, and concise in your responses
-            3. If a question cannot be answered from the PDF content, politely state that the information is not available in the document
-            4. Maintain a professional and friendly tone
-            5. Focus on providing relevant information from the document
-            """
-            
-            # Prepend context to the user message
-            contextual_message = f"{hotel_context}\n\nUser question: {message}"
+            # Return the cached answer if a near-identical question was asked before
+            query_vector = None
+            if self.cache_size > 0:
+                query_vector = self._embed_message(message)
+                cached = self._lookup_cached_response(query_vector)
+                if cached is not None:
+                    logger.info("Semantic cache hit")
+                    self.memory.save_context({"query": message}, {"result": cached})
+                    return cached
             
-            # Query the vector store
-            response = self.store.query(
-                contextual_message, 
-                llm=self.llm, 
-                memory=self.memory
-            )
-            
-            return response
+            # Retrieve on the raw question; the system prompt is part of the chain's template
+            response = self._qa.invoke({"query": message})["result"]
             
         except Exception as e:
             logger.error(f"Error getting response: {str(e)}")
             return "I apologize, but I encountered an error while processing your question. Please try again or rephrase your question."
+        
+        # A caching failure must not discard an answer the LLM already produced
+        if query_vector is not None:
+            try:
+                self._store_cached_response(query_vector, response)
+            except Exception as e:
+                logger.error(f"Error caching response: {str(e)}")
+        return response
+    
+    def _embed_message(self, message):
+        """Embed a user message as an int8-quantized unit vector for the semantic cache."""
+        vector = np.asarray(self.embedding.embed_query(message), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return np.rint(vector * INT8_SCALE).astype(np.int8)
+    
+    def _lookup_cached_response(self, query_vector):
+        """Return the cached response most similar to the query, if above the threshold."""
+        if self.cache_size <= 0 or not self._qcache:
+            return None
+        
+        # Rebuild the stacked embedding matrix lazily after inserts, widened once to
+        # int32 so the products accumulate without int8 overflow
+        if self._qcache_matrix is None:
+            self._qcache_matrix = np.vstack([entry[0] for entry in self._qcache]).astype(np.int32)
+        
+        sims = self._qcache_matrix @ query_vector.astype(np.int32)
+        best = int(np.argmax(sims))
+        if sims[best] < self.cache_threshold * INT8_SCALE * INT8_SCALE:
+            return None
+        
+        self._qcache_tick += 1
+        self._qcache[best][2] = self._qcache_tick
+        return self._qcache[best][1]
+    
+    def _store_cached_response(self, query_vector, response):
+        """Insert a response into the semantic cache, evicting the least recently used entry."""
+        if self.cache_size <= 0:
+            return
+        self._qcache_tick += 1
+        entry = [query_vector, response, self._qcache_tick]
+        if len(self._qcache) < self.cache_size:
+            self._qcache.append(entry)
+        else:
+            oldest = min(range(len(self._qcache)), key=lambda i: self._qcache[i][2])
+            self._qcache[oldest] = entry
+        self._qcache_matrix = None
+    
+    def close(self):
+        """Release the vector index, memory and cached responses held by this service."""
+        self.store = None
+        self._qa = None
+        self.memory = None
+        self._qcache = []
+        self._qcache_matrix = None
     
     def clear_memory(self):
         """Clear the conversation memory."""
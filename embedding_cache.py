@@ -0,0 +1,187 @@
+import os
+import hashlib
+import logging
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Configuration
+CACHE_DIR = os.getenv("CACHE_DIR", "cache")  # Root for all on-disk caches
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(CACHE_DIR, "embeddings.sqlite3"))
+EMBEDDING_CACHE_MEMORY_SIZE = 4096  # vectors kept in the in-process LRU
+EMBEDDING_BATCH_SIZE = 32  # texts per upstream embedding request
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "16"))
+
+
+class EmbeddingCache:
+    """SQLite-backed cache of embedding vectors with an in-memory LRU in front."""
+
+    def __init__(self, path, memory_size=EMBEDDING_CACHE_MEMORY_SIZE):
+        """Open (or create) the cache database at the given path."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.memory_size = memory_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS emb (key TEXT PRIMARY KEY, vec BLOB)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model, kind, text):
+        """Build the cache key for a text embedded by a given model and method."""
+        return hashlib.sha256(f"{model}\0{kind}\0{text}".encode()).hexdigest()
+
+    def get_many(self, keys):
+        """Return a dict of the cached vectors found for the given keys."""
+        found = {}
+        with self._lock:
+            missing = []
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+                else:
+                    missing.append(key)
+
+            # SQLite limits the number of bound parameters per statement
+            for start in range(0, len(missing), 500):
+                batch = missing[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vec FROM emb WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array('f', blob).tolist()
+                    found[key] = vector
+                    self._remember(key, vector)
+        return found
+
+    def set_many(self, items):
+        """Store the given (key, vector) pairs."""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO emb (key, vec) VALUES (?, ?)",
+                [(key, array('f', vector).tobytes()) for key, vector in items]
+            )
+            self._conn.commit()
+            for key, vector in items:
+                self._remember(key, vector)
+
+    def _remember(self, key, vector):
+        """Insert a vector into the in-memory LRU, evicting the oldest entry."""
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+
+# Global embedding cache instance
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+# Shared pool bounding concurrent embedding requests across all uploads
+_embedding_executor = ThreadPoolExecutor(
+    max_workers=EMBEDDING_CONCURRENCY,
+    thread_name_prefix="embedding"
+)
+
+
+def get_embedding_cache():
+    """Return the process-wide embedding cache, opening it on first use."""
+    global _embedding_cache
+
+    if _embedding_cache is None:
+        with _embedding_cache_lock:
+            if _embedding_cache is None:
+                logger.info(f"Opening embedding cache: {EMBEDDING_CACHE_PATH}")
+                _embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH)
+    return _embedding_cache
+
+
+class CachedEmbeddings(GoogleGenerativeAIEmbeddings):
+    """Google Generative AI embeddings that skip the API call for previously seen texts."""
+
+    @staticmethod
+    def _open_cache(kwargs):
+        """Return the embedding cache, or None when it must be bypassed or cannot be opened."""
+        # Keys only cover model, method and text, so per-call options skip the cache
+        if kwargs:
+            return None
+        try:
+            return get_embedding_cache()
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Error opening embedding cache: {str(e)}")
+            return None
+
+    def embed_documents(self, texts, **kwargs):
+        """Embed documents, only sending cache misses to the API."""
+        cache = self._open_cache(kwargs)
+        if cache is None:
+            return self._embed_parallel(texts, **kwargs)
+
+        keys = [EmbeddingCache.make_key(self.model, "document", text) for text in texts]
+        try:
+            found = cache.get_many(keys)
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Error reading embedding cache: {str(e)}")
+            return self._embed_parallel(texts, **kwargs)
+
+        # Send only the misses upstream, embedding each distinct text once
+        misses = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in misses:
+                misses[key] = text
+        if misses:
+            logger.info(f"Embedding cache: {len(texts) - len(misses)} hits, {len(misses)} misses")
+            vectors = self._embed_parallel(list(misses.values()), **kwargs)
+            new_items = list(zip(misses.keys(), vectors))
+            try:
+                cache.set_many(new_items)
+            except (sqlite3.Error, OSError) as e:
+                logger.error(f"Error writing embedding cache: {str(e)}")
+            found.update(new_items)
+
+        return [found[key] for key in keys]
+
+    def _embed_parallel(self, texts, **kwargs):
+        """Embed texts in fixed-size batches, overlapping the upstream requests."""
+        embed = super().embed_documents
+        batches = [texts[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(texts), EMBEDDING_BATCH_SIZE)]
+        if len(batches) == 1:
+            return embed(texts, **kwargs)
+
+        vectors = []
+        for batch_vectors in _embedding_executor.map(lambda batch: embed(batch, **kwargs), batches):
+            vectors.extend(batch_vectors)
+        return vectors
+
+    def embed_query(self, text, **kwargs):
+        """Embed a query, returning the cached vector when available."""
+        cache = self._open_cache(kwargs)
+        if cache is None:
+            return super().embed_query(text, **kwargs)
+
+        key = EmbeddingCache.make_key(self.model, "query", text)
+        try:
+            found = cache.get_many([key])
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Error reading embedding cache: {str(e)}")
+            found = {}
+        if key in found:
+            return found[key]
+
+        vector = super().embed_query(text, **kwargs)
+        try:
+            cache.set_many([(key, vector)])
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Error writing embedding cache: {str(e)}")
+        return vector